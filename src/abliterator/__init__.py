@@ -1,16 +1,27 @@
+from importlib import import_module
+
 from abliterator.chat_template import (
     LLAMA3_CHAT_TEMPLATE,
     PHI3_CHAT_TEMPLATE,
     ChatTemplate,
     TokenizerChatTemplate,
 )
-from abliterator.data import (
-    get_harmful_instructions,
-    get_harmless_instructions,
-    prepare_dataset,
-)
-from abliterator.model_abliterator import ModelAbliterator
-from abliterator.util import batch, clear_mem, measure_fn
+
+# Everything outside chat_template pulls in heavy dependencies (datasets,
+# torch, transformer_lens), so those symbols resolve lazily (PEP 562) and
+# `import abliterator` stays cheap for template-only users.
+_LAZY_ATTRS = {
+    "get_harmful_instructions": "abliterator.data",
+    "get_harmless_instructions": "abliterator.data",
+    "prepare_dataset": "abliterator.data",
+    "prepare_dataset_from_list": "abliterator.data",
+    "prepare_dataset_presplit": "abliterator.data",
+    "ModelAbliterator": "abliterator.model_abliterator",
+    "batch": "abliterator.util",
+    "batch_slices": "abliterator.util",
+    "clear_mem": "abliterator.util",
+    "measure_fn": "abliterator.util",
+}
 
 __all__ = [
     "LLAMA3_CHAT_TEMPLATE",
@@ -20,8 +31,24 @@ __all__ = [
     "get_harmful_instructions",
     "get_harmless_instructions",
     "prepare_dataset",
+    "prepare_dataset_from_list",
+    "prepare_dataset_presplit",
     "ModelAbliterator",
     "batch",
+    "batch_slices",
     "clear_mem",
     "measure_fn",
 ]
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRS.get(name)
+    if module_name is None:
+        raise AttributeError(  # noqa: TRY003 - stdlib-standard message
+            f"module {__name__!r} has no attribute {name!r}"
+        )
+    return getattr(import_module(module_name), name)
+
+
+def __dir__() -> list[str]:
+    return sorted(__all__)
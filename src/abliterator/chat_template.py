@@ -1,15 +1,70 @@
-from jinja2 import Template
+import hashlib
+import sys
+from pathlib import Path
+from typing import ClassVar, Final
+
+from jinja2 import Environment, FileSystemBytecodeCache, FunctionLoader, Template
+
+# Shared environment with an on-disk bytecode cache so compiling a tokenizer's
+# chat template (often several KB of Jinja) is paid once across processes.
+# Jinja only consults the bytecode cache on the loader path, so sources are
+# registered under a content hash and compiled via get_template — from_string
+# would bypass the cache entirely.
+_JINJA_CACHE_DIR = Path("~/.cache/abliterator/jinja").expanduser()
+_JINJA_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+_TEMPLATE_SOURCES: dict[str, str] = {}
+# templates render prompts, not HTML, so autoescape stays off
+_env = Environment(  # noqa: S701
+    loader=FunctionLoader(_TEMPLATE_SOURCES.get),
+    bytecode_cache=FileSystemBytecodeCache(directory=str(_JINJA_CACHE_DIR)),
+    auto_reload=False,
+)
+
+
+def _compile_template(src: str) -> Template:
+    name = hashlib.sha256(src.encode()).hexdigest()
+    _TEMPLATE_SOURCES[name] = src
+    return _env.get_template(name)
+
+# interned so every user shares one string object (these are too long for
+# CPython's automatic small-string interning)
+LLAMA3_CHAT_TEMPLATE: Final[str] = sys.intern(
+    """<|start_header_id|>user<|end_header_id|>\n{instruction}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"""
+)
+PHI3_CHAT_TEMPLATE: Final[str] = sys.intern(
+    """<|user|>\n{instruction}<|end|>\n<|assistant|>"""
+)
+
+
+def _split_template(template: str) -> tuple[str, str]:
+    prefix, suffix = template.split("{instruction}")
+    return prefix, suffix
+
+
+# Prebuilt (prefix, suffix) pairs for the shipped templates, computed once at
+# import so constructing a ChatTemplate from them skips the split entirely.
+_LLAMA3_PARTS = _split_template(LLAMA3_CHAT_TEMPLATE)
+_PHI3_PARTS = _split_template(PHI3_CHAT_TEMPLATE)
 
-LLAMA3_CHAT_TEMPLATE = """<|start_header_id|>user<|end_header_id|>\n{instruction}<|eot_id|><|start_header_id|>assistant<|end_header_id|>\n\n"""
-PHI3_CHAT_TEMPLATE = """<|user|>\n{instruction}<|end|>\n<|assistant|>"""
 
 class ChatTemplate:
-    def __init__(self, model, template):
+    # slots keep the many short-lived context-manager instances off the
+    # per-instance dict and make format()'s attribute reads C-slot lookups
+    __slots__ = ("_prefix", "_suffix", "model", "prev", "template")
+
+    def __init__(self, model, template: str | tuple[str, str]):
         self.model = model
         self.template = template
+        # The templates hold exactly one '{instruction}' slot, so splitting once
+        # here turns every format() into plain string concatenation instead of a
+        # str.format mini-language parse.
+        if isinstance(template, str):
+            self._prefix, self._suffix = _split_template(template)
+        else:
+            self._prefix, self._suffix = template
 
     def format(self, instruction: str) -> str:
-        return self.template.format(instruction=instruction)
+        return self._prefix + instruction + self._suffix
 
     def __enter__(self):
         self.prev = self.model.chat_template
@@ -22,9 +77,21 @@ class ChatTemplate:
 
 
 class TokenizerChatTemplate(ChatTemplate):
+    __slots__ = ("_template", "tokenizer")
+
+    # Compiled templates keyed on (tokenizer class, template source) so repeated
+    # constructions (e.g. per batch) skip Jinja's lexer/parser.
+    _TEMPLATE_CACHE: ClassVar[dict[tuple[type, str], Template]] = {}
+
     def __init__(self, tokenizer) -> None:
         self.tokenizer = tokenizer
-        self._template = Template(tokenizer.get_chat_template())
+        src = tokenizer.get_chat_template()
+        key = (type(tokenizer), src)
+        template = TokenizerChatTemplate._TEMPLATE_CACHE.get(key)
+        if template is None:
+            template = _compile_template(src)
+            TokenizerChatTemplate._TEMPLATE_CACHE[key] = template
+        self._template = template
 
     def format(self, instruction: str) -> str:
         messages = [{"role": "user", "content": instruction}]
@@ -1,36 +1,126 @@
-from datasets import load_dataset
-from sklearn.model_selection import train_test_split
+import pickle
+from functools import lru_cache
+from pathlib import Path
+from typing import TYPE_CHECKING
 
+if TYPE_CHECKING:
+    from datasets import DatasetDict
 
-def get_harmful_instructions() -> tuple[list[str], list[str]]:
-    hf_path = "Undi95/orthogonal-activation-steering-TOXIC"
-    dataset = load_dataset(hf_path)
-    instructions = [i["goal"] for i in dataset["test"]]
+CACHE_DIR = Path("~/.cache/abliterator").expanduser()
+
+
+def _split(
+    data: list[str],
+    test_size: float = 0.2,
+    seed: int = 42,
+    shuffle: bool = True,
+) -> tuple[tuple[str, ...], tuple[str, ...]]:
+    # shuffle the strings into one contiguous object array and cut it, so both
+    # halves come out of adjacent memory instead of scatter-gather indexing
+    import numpy as np
 
-    train, test = train_test_split(instructions, test_size=0.2, random_state=42)
+    arr = np.asarray(data, dtype=object)
+    if shuffle:
+        np.random.default_rng(seed).shuffle(arr)
+    n_test = int(len(arr) * test_size)
+    train = tuple(arr[n_test:].tolist())
+    test = tuple(arr[:n_test].tolist())
     return train, test
 
 
-def get_harmless_instructions() -> tuple[list[str], list[str]]:
-    hf_path = "tatsu-lab/alpaca"
+def _cached_load(hf_path: str) -> "DatasetDict":
+    # Save the hub dataset to disk once so later runs skip the network
+    # round-trips load_dataset makes even on a warm HF cache.
+    from datasets import load_dataset, load_from_disk
+
+    local_dir = CACHE_DIR / hf_path.replace("/", "--")
+    if local_dir.exists():
+        return load_from_disk(local_dir)
     dataset = load_dataset(hf_path)
-    # filter for instructions that do not have inputs
-    instructions = []
-    for i in range(len(dataset["train"])):
-        if dataset["train"][i]["input"].strip() == "":
-            instructions.append(dataset["train"][i]["instruction"])
+    local_dir.parent.mkdir(parents=True, exist_ok=True)
+    dataset.save_to_disk(local_dir)
+    return dataset
+
+
+def _disk_cached(key: str, fn):
+    # Persist the final (train, test) split; a cache hit is one read plus a
+    # pickle load instead of the whole load/filter/split pipeline.
+    path = CACHE_DIR / f"{key}.pkl"
+    if path.exists():
+        # our own cache file, not untrusted input
+        return pickle.loads(path.read_bytes())  # noqa: S301
+    value = fn()
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(pickle.dumps(value))
+    return value
+
+
+def _get_harmful_impl() -> tuple[tuple[str, ...], tuple[str, ...]]:
+    hf_path = "Undi95/orthogonal-activation-steering-TOXIC"
+    dataset = _cached_load(hf_path)
+    # narrow the Arrow schema to the one column we read, then convert it in a
+    # single C-level pass instead of materializing a dict per row
+    instructions = list(dataset["test"].select_columns(["goal"])["goal"])
+
+    return _split(instructions)
+
+
+@lru_cache(maxsize=1)
+def get_harmful_instructions() -> tuple[tuple[str, ...], tuple[str, ...]]:
+    return _disk_cached("toxic_harmful_v1", _get_harmful_impl)
 
-    train, test = train_test_split(instructions, test_size=0.2, random_state=42)
+
+def _get_harmless_impl() -> tuple[tuple[str, ...], tuple[str, ...]]:
+    hf_path = "tatsu-lab/alpaca"
+    # filter for instructions that do not have inputs, entirely inside Arrow:
+    # one vectorized trim pass, one boolean filter, one bulk conversion, with
+    # no Python-level iteration over the rows
+    import pyarrow.compute as pc
+
+    dataset = _cached_load(hf_path)
+    table = dataset["train"].data.table
+    mask = pc.equal(pc.utf8_trim_whitespace(table.column("input")), "")
+    instructions = table.column("instruction").filter(mask).to_pylist()
+
+    return _split(instructions)
+
+
+@lru_cache(maxsize=1)
+def get_harmless_instructions() -> tuple[tuple[str, ...], tuple[str, ...]]:
+    return _disk_cached("alpaca_harmless_v1", _get_harmless_impl)
+
+
+def prepare_dataset_from_list(
+    instructions: list[str],
+    test_size: float = 0.1,
+    shuffle: bool = True,
+    seed: int = 42,
+) -> tuple[list[str], list[str]]:
+    train, test = _split(
+        list(instructions), test_size=test_size, seed=seed, shuffle=shuffle
+    )
+    return list(train), list(test)
+
+
+def prepare_dataset_presplit(
+    dataset: tuple[list[str], list[str]],
+) -> tuple[list[str], list[str]]:
+    train, test = dataset
     return train, test
 
 
 def prepare_dataset(
     dataset: tuple[list[str], list[str]] | list[str],
+    test_size: float = 0.1,
+    shuffle: bool = True,
+    seed: int = 42,
 ) -> tuple[list[str], list[str]]:
-    if len(dataset) != 2:
-        # assumed to not be split into train/test
-        train, test = train_test_split(dataset, test_size=0.1, random_state=42)
-    else:
-        train, test = dataset
-
-    return train, test
+    # compat shim; callers that know which form they hold can use the typed
+    # entry points above and skip the dispatch
+    if len(dataset) == 2 and not isinstance(dataset[0], str):
+        return prepare_dataset_presplit(dataset)
+    # assumed to not be split into train/test; callers that already shuffled
+    # can pass shuffle=False and skip the O(N) permutation pass
+    return prepare_dataset_from_list(
+        dataset, test_size=test_size, shuffle=shuffle, seed=seed
+    )
@@ -1,23 +1,42 @@
-import functools
+import contextlib
+import hashlib
+import math
+import os
 import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
 from typing import Callable
 
-import einops
 import torch
 import torch.nn.functional as F
 from jaxtyping import Float, Int
 from torch import Tensor
 from tqdm import tqdm
-from transformer_lens import ActivationCache, HookedTransformer, utils
+from transformer_lens import (
+    ActivationCache,
+    HookedTransformer,
+    HookedTransformerKeyValueCache,
+    utils,
+)
 from transformer_lens.hook_points import HookPoint
 from transformers import AutoModelForCausalLM
 
 from abliterator.chat_template import LLAMA3_CHAT_TEMPLATE, ChatTemplate
-from abliterator.data import prepare_dataset
+from abliterator.data import CACHE_DIR, prepare_dataset
 from abliterator.util import batch, clear_mem, measure_fn
 
 DEFAULT_ACTIVATION_LAYERS = ("resid_pre", "resid_post", "mlp_out", "attn_out")
 
+# let the Rust tokenizer backend keep its worker pool alive alongside our
+# thread sharding instead of disabling itself after the first fork warning
+os.environ.setdefault("TOKENIZERS_PARALLELISM", "true")
+
+# get_act_name string-formats its result on every call; the set of names a run
+# ever asks for is small and fixed, so memoize it once for the module
+_get_act_name = lru_cache(maxsize=None)(utils.get_act_name)
+
 
 class ModelAbliterator:
     def __init__(
@@ -33,6 +52,10 @@ class ModelAbliterator:
         negative_toks: list[int] | tuple[int] | set[int] | Int[Tensor, "..."] = None,
         dtype: torch.dtype | str | None = None,
         hf_model: AutoModelForCausalLM | None = None,
+        track_history: bool = False,
+        compile_decode: bool = False,
+        compile_model: bool = False,
+        cache_dtype: torch.dtype = torch.bfloat16,
     ) -> None:
         self.MODEL_PATH = model
         activation_layers = activation_layers or list(DEFAULT_ACTIVATION_LAYERS)
@@ -44,11 +67,21 @@ class ModelAbliterator:
         # Save memory
         torch.set_grad_enabled(False)
 
+        if dtype is None:
+            # mean-direction extraction doesn't need fp32 activations, so on
+            # tensor-core GPUs default to bf16 for bandwidth and throughput
+            has_bf16_cores = (
+                str(device).startswith("cuda")
+                and torch.cuda.is_available()
+                and torch.cuda.get_device_capability()[0] >= 8
+            )
+            dtype = torch.bfloat16 if has_bf16_cores else "float32"
+
         model_options = {
             "model_name": model,
             "n_devices": n_devices,
             "device": device,
-            "dtype": dtype or "float32",
+            "dtype": dtype,
             "default_padding_side": "left",
             "hf_model": hf_model,
         }
@@ -59,14 +92,40 @@ class ModelAbliterator:
 
         self.model.tokenizer.padding_side = "left"
         self.model.tokenizer.pad_token = self.model.tokenizer.eos_token
+
+        # single-token decode steps have a static shape, which is where
+        # reduce-overhead compilation pays off without constant recompiles;
+        # opt-in because hooked forwards fall back to eager anyway
+        self._compiled_model = None
+        if compile_decode and torch.cuda.is_available():
+            self._compiled_model = torch.compile(
+                self.model, mode="reduce-overhead", fullgraph=False, dynamic=False
+            )
         self.chat_template = chat_template or ChatTemplate(self, LLAMA3_CHAT_TEMPLATE)
 
         self.hidden_size = self.model.cfg.d_model
+
+        def _snapshot(value: Tensor) -> Tensor:
+            # pinned host copies let the targeted restores in reset_state
+            # overlap their H2D transfers with compute
+            if torch.cuda.is_available():
+                out = torch.empty_like(value, device="cpu", pin_memory=True)
+                out.copy_(value)
+                return out
+            return value.to("cpu", copy=True)
+
         self.original_state = {
-            k: v.to("cpu") for k, v in self.model.state_dict().items()
+            k: _snapshot(v) for k, v in self.model.state_dict().items()
         }
         self.harmful = {}
         self.harmless = {}
+        # storage dtype for cached activations; downstream mean-direction math
+        # upcasts to fp32 where it matters, so halving the bytes held (and
+        # moved) per cached row is nearly free
+        self.cache_dtype = cache_dtype
+        # keeping full before/after weight copies costs a D2H transfer per
+        # modification, so it's opt-in; the layer keys are always recorded
+        self.track_history = track_history
         self.modified_layers = {"mlp": {}, "W_O": {}}
         self.checkpoints = []
 
@@ -86,11 +145,45 @@ class ModelAbliterator:
             if isinstance(activation_layers, str)
             else activation_layers
         )
+        self._init_score_toks(positive_toks, negative_toks)
+        # prebuilt hook list for test_dir; the direction lives in a swappable
+        # buffer so candidate sweeps reuse the same closures
+        self._test_dir_hooks = None
+        self._hook_direction = None
+        # template (prefix, suffix) -> token ids, so the fixed chat template
+        # text is tokenized once instead of once per instruction
+        self._prompt_parts_cache = {}
+        self._invalidate_dir_caches()
+        self._blacklisted = set()
+        # pure functions of the blacklist and activation layers; rebuilt when
+        # the blacklist changes
+        self._whitelisted_cache = None
+        self._act_names_cache = None
+        # reusable token buffer for generate_logits; grows monotonically so
+        # the generate hot path stops churning the allocator
+        self._gen_buf = None
+        # caching-hook lists from get_caching_hooks, keyed per filter/options;
+        # rebuilding them walks the whole hook registry every batch
+        self._default_names_filter = None
+        self._caching_hooks_cache = {}
+        if compile_model and torch.cuda.is_available():
+            # shape-specialized compile of the whole model: with bucketed
+            # capture there are only a handful of distinct (batch, seq)
+            # shapes, so dynamic=False recompiles once per shape and then
+            # replays fused kernels; hooks show up as graph breaks but the
+            # blocks between them still compile. First calls pay warmup.
+            # Opt-in because hook-heavy workflows can thrash the compile
+            # cache if batch shapes are not kept stable.
+            self.model = torch.compile(
+                self.model, mode="reduce-overhead", fullgraph=False, dynamic=False
+            )
+
+    def _init_score_toks(self, positive_toks, negative_toks) -> None:
         if negative_toks is None:
             print(
                 "WARNING: You've not set 'negative_toks', defaulting to tokens for Llama-3 vocab"
             )
-            self.negative_toks = {
+            negative_toks = {
                 4250,
                 14931,
                 89735,
@@ -99,37 +192,59 @@ class ModelAbliterator:
                 11458,
                 956,
             }  # llama-3 refusal tokens e.g. ' cannot', ' unethical', ' sorry'
-        else:
-            self.negative_toks = negative_toks
+        self.negative_toks = negative_toks
         if positive_toks is None:
             print(
                 "WARNING: You've not set 'positive_toks', defaulting to tokens for Llama-3 vocab"
             )
-            self.positive_toks = {32, 1271, 8586, 96556, 78145}
-        else:
-            self.positive_toks = positive_toks
-        self._blacklisted = set()
+            positive_toks = {32, 1271, 8586, 96556, 78145}
+        self.positive_toks = positive_toks
+        # fixed column order for gathering scored-token logits on device
+        self._score_toks = torch.tensor(
+            list(self.positive_toks) + list(self.negative_toks), dtype=torch.long
+        )
+        self._neg_toks = torch.tensor(list(self.negative_toks), dtype=torch.long)
 
     def __enter__(self):
         if hasattr(self, "current_state"):
             raise Exception("Cannot do multi-contexting")
-        self.current_state = self.model.state_dict()
-        self.current_layers = self.modified_layers.copy()
+        # weights written inside the context get a CPU clone on first touch
+        # (see layer_attn/layer_mlp); snapshotting the full state dict here
+        # copied and restored every parameter even when only a few changed
+        self.current_state = {}
+        self.current_layers = {
+            "mlp": dict(self.modified_layers["mlp"]),
+            "W_O": dict(self.modified_layers["W_O"]),
+        }
         self.was_modified = self.modified
         return self
 
     def __exit__(self, exc, exc_value, exc_tb):
-        self.model.load_state_dict(self.current_state)
+        for (kind, layer), saved in self.current_state.items():
+            self._weight_matrix(kind, layer).copy_(saved, non_blocking=True)
         del self.current_state
         self.modified_layers = self.current_layers
         del self.current_layers
         self.modified = self.was_modified
         del self.was_modified
 
+    def _weight_matrix(self, kind: str, layer: int) -> Float[Tensor, "... d_model"]:
+        if kind == "W_O":
+            return self.model.blocks[layer].attn.W_O.data
+        return self.model.blocks[layer].mlp.W_out.data
+
     def reset_state(self):
+        # restore only the layers that were actually touched instead of
+        # pushing the entire original state dict back onto the devices
+        for kind, layers in self.modified_layers.items():
+            for layer in layers:
+                suffix = "attn.W_O" if kind == "W_O" else "mlp.W_out"
+                self._weight_matrix(kind, layer).copy_(
+                    self.original_state[f"blocks.{layer}.{suffix}"],
+                    non_blocking=True,
+                )
         self.modified = False
         self.modified_layers = {"mlp": {}, "W_O": {}}
-        self.model.load_state_dict(self.original_state)
 
     def checkpoint(self):
         # MAYBE: Offload to disk? That way we're not taking up RAM with this
@@ -143,6 +258,9 @@ class ModelAbliterator:
             self._blacklisted.update(layer)
         else:
             self._blacklisted.add(layer)
+        self._test_dir_hooks = None
+        self._whitelisted_cache = None
+        self._act_names_cache = None
 
     def whitelist_layer(self, layer: int | list[int]):
         # Removes layer from blacklist to allow modification
@@ -150,6 +268,9 @@ class ModelAbliterator:
             self._blacklisted.difference_update(layer)
         else:
             self._blacklisted.discard(layer)
+        self._test_dir_hooks = None
+        self._whitelisted_cache = None
+        self._act_names_cache = None
 
     def save_activations(self, fname: str):
         torch.save(
@@ -165,48 +286,62 @@ class ModelAbliterator:
         )
 
     def get_whitelisted_layers(self) -> list[int]:
-        return [l for l in range(self.model.cfg.n_layers) if l not in self._blacklisted]
+        if self._whitelisted_cache is None:
+            self._whitelisted_cache = [
+                l
+                for l in range(self.model.cfg.n_layers)
+                if l not in self._blacklisted
+            ]
+        return self._whitelisted_cache
 
     def get_all_act_names(
         self, activation_layers: list[str] | None = None
     ) -> list[tuple[int, str]]:
-        return [
-            (i, utils.get_act_name(act_name, i))
-            for i in self.get_whitelisted_layers()
-            for act_name in (activation_layers or self.activation_layers)
-        ]
+        if activation_layers is not None:
+            return [
+                (i, _get_act_name(act_name, i))
+                for i in self.get_whitelisted_layers()
+                for act_name in activation_layers
+            ]
+        if self._act_names_cache is None:
+            self._act_names_cache = [
+                (i, _get_act_name(act_name, i))
+                for i in self.get_whitelisted_layers()
+                for act_name in self.activation_layers
+            ]
+        return self._act_names_cache
+
+    def _invalidate_dir_caches(self):
+        # per-key means and the layer-filtered key list only change when the
+        # activation caches are rebuilt
+        self._mean_dirs_cache = {"harmful": {}, "harmless": {}}
+        self._refusal_keys = None
+
+    def _cached_mean(self, which: str, key: str) -> Float[Tensor, "d_model"]:
+        store = self._mean_dirs_cache[which]
+        mean = store.get(key)
+        if mean is None:
+            # cached rows may be stored narrow (see cache_dtype); accumulate
+            # the mean in fp32 regardless
+            mean = torch.mean(getattr(self, which)[key], dim=0, dtype=torch.float32)
+            store[key] = mean
+        return mean
 
     def calculate_mean_dirs(
         self, key: str, include_overall_mean: bool = False
     ) -> dict[str, Float[Tensor, "d_model"]]:
         dirs = {
-            "harmful_mean": torch.mean(self.harmful[key], dim=0),
-            "harmless_mean": torch.mean(self.harmless[key], dim=0),
+            "harmful_mean": self._cached_mean("harmful", key),
+            "harmless_mean": self._cached_mean("harmless", key),
         }
 
         if include_overall_mean:
-            if (
-                self.harmful[key].shape != self.harmless[key].shape
-                or self.harmful[key].device.type == "cuda"
-            ):
-                # If the shapes are different, we can't add them together; we'll need to concatenate the tensors first.
-                # Using 'cpu', this is slower than the alternative below.
-                # Using 'cuda', this seems to be faster than the alternatives.
-                # NOTE: Assume both tensors are on the same device.
-                #
-                dirs["mean_dir"] = torch.mean(
-                    torch.cat((self.harmful[key], self.harmless[key]), dim=0), dim=0
-                )
-            else:
-                # If the shapes are the same, we can add them together, take the mean,
-                # then divide by 2.0 to account for the initial element-wise addition of the tensors.
-                #
-                # The result is identical to:
-                #    `torch.sum(self.harmful[key] + self.harmless[key]) / (len(self.harmful[key]) + len(self.harmless[key]))`
-                #
-                dirs["mean_dir"] = (
-                    torch.mean(self.harmful[key] + self.harmless[key], dim=0) / 2.0
-                )
+            # weighted mean from the two per-set sums; works for mismatched
+            # row counts and never materializes the [2N, d_model] concatenation
+            # NOTE: Assume both tensors are on the same device.
+            dirs["mean_dir"] = (
+                self.harmful[key].sum(dim=0) + self.harmless[key].sum(dim=0)
+            ) / (self.harmful[key].shape[0] + self.harmless[key].shape[0])
 
         return dirs
 
@@ -215,21 +350,19 @@ class ModelAbliterator:
         components: Float[Tensor, "... d_model"],
         direction: Float[Tensor, "d_model"],
     ) -> Float[Tensor, "... d_model"]:
-        return (
-            einops.einsum(
-                components,
-                direction.view(-1, 1),
-                "... d_model, d_model column -> ... column",
-            )
-            * direction
-        )
+        # native matvec goes straight to cuBLAS; einops adds dispatch overhead
+        return (components @ direction).unsqueeze(-1) * direction
 
     def calculate_ortho_complement(
         self,
         components: Float[Tensor, "... d_model"],
         direction: Float[Tensor, "d_model"],
     ) -> Float[Tensor, "... d_model"]:
-        return components - self.calculate_scaled_projection(components, direction)
+        # addcmul fuses the scale-and-subtract into one kernel, so components
+        # is read twice and written once instead of three full passes with two
+        # large temporaries; this runs per token inside ortho_complement_hook
+        coef = components @ direction
+        return torch.addcmul(components, coef.unsqueeze(-1), direction, value=-1)
 
     def get_avg_projections(
         self, key: str, direction: Float[Tensor, "d_model"]
@@ -257,31 +390,42 @@ class ModelAbliterator:
         hook: HookPoint,
         direction: Float[Tensor, "d_model"],
     ) -> Float[Tensor, "... d_model"]:
-        if activation.device != direction.device:
-            direction = direction.to(activation.device)
+        if (
+            activation.device != direction.device
+            or activation.dtype != direction.dtype
+        ):
+            # refusal dirs accumulate in fp32 while the model may run bf16;
+            # a mixed-dtype matvec raises instead of promoting
+            direction = direction.to(device=activation.device, dtype=activation.dtype)
         return self.calculate_ortho_complement(activation, direction)
 
+    def _buffered_direction_hook(
+        self,
+        activation: Float[Tensor, "... d_model"],
+        hook: HookPoint,
+    ) -> Float[Tensor, "... d_model"]:
+        return self.ortho_complement_hook(
+            activation, hook, direction=self._hook_direction
+        )
+
     def refusal_dirs(self, invert: bool = False) -> dict[str, Float[Tensor, "d_model"]]:
         if not self.harmful:
             raise IndexError("No cache")
 
-        refusal_dirs = {
-            key: self.calculate_mean_dirs(key)
-            for key in self.harmful
-            if ".0." not in key
-        }  # don't include layer 0, as it often becomes NaN
-        if invert:
-            refusal_dirs = {
-                key: v["harmless_mean"] - v["harmful_mean"]
-                for key, v in refusal_dirs.items()
-            }
-        else:
-            refusal_dirs = {
-                key: v["harmful_mean"] - v["harmless_mean"]
-                for key, v in refusal_dirs.items()
-            }
+        if self._refusal_keys is None:
+            # don't include layer 0, as it often becomes NaN
+            self._refusal_keys = [key for key in self.harmful if ".0." not in key]
+
+        refusal_dirs = {}
+        for key in self._refusal_keys:
+            direction = self._cached_mean("harmful", key) - self._cached_mean(
+                "harmless", key
+            )
+            if invert:
+                direction = -direction
+            refusal_dirs[key] = (direction / direction.norm()).to("cpu")
 
-        return {key: (v / v.norm()).to("cpu") for key, v in refusal_dirs.items()}
+        return refusal_dirs
 
     def scored_dirs(self, invert=False) -> list[tuple[str, Float[Tensor, "d_model"]]]:
         refusals = self.refusal_dirs(invert=invert)
@@ -301,16 +445,24 @@ class ModelAbliterator:
         if replacement is not None and layer not in self._blacklisted:
             # make sure device doesn't change
             self.modified = True
-            self.model.blocks[layer].attn.W_O.data = replacement.to(
-                self.model.blocks[layer].attn.W_O.device
-            )
-            self.modified_layers["W_O"][layer] = [
-                *self.modified_layers.get(layer, []),
-                (
-                    self.model.blocks[layer].attn.W_O.data.to("cpu"),
-                    replacement.to("cpu"),
-                ),
-            ]
+            if (
+                hasattr(self, "current_state")
+                and ("W_O", layer) not in self.current_state
+            ):
+                self.current_state[("W_O", layer)] = self.model.blocks[
+                    layer
+                ].attn.W_O.data.to("cpu", copy=True)
+            history = self.modified_layers["W_O"].get(layer, [])
+            if self.track_history:
+                history = [
+                    *history,
+                    (
+                        self.model.blocks[layer].attn.W_O.data.to("cpu"),
+                        replacement.to("cpu"),
+                    ),
+                ]
+            self.modified_layers["W_O"][layer] = history
+            self.model.blocks[layer].attn.W_O.data.copy_(replacement)
         return self.model.blocks[layer].attn.W_O.data
 
     def layer_mlp(
@@ -319,28 +471,109 @@ class ModelAbliterator:
         if replacement is not None and layer not in self._blacklisted:
             # make sure device doesn't change
             self.modified = True
-            self.model.blocks[layer].mlp.W_out.data = replacement.to(
-                self.model.blocks[layer].mlp.W_out.device
-            )
-            self.modified_layers["mlp"][layer] = [
-                *self.modified_layers.get(layer, []),
-                (
-                    self.model.blocks[layer].mlp.W_out.data.to("cpu"),
-                    replacement.to("cpu"),
-                ),
-            ]
+            if (
+                hasattr(self, "current_state")
+                and ("mlp", layer) not in self.current_state
+            ):
+                self.current_state[("mlp", layer)] = self.model.blocks[
+                    layer
+                ].mlp.W_out.data.to("cpu", copy=True)
+            history = self.modified_layers["mlp"].get(layer, [])
+            if self.track_history:
+                history = [
+                    *history,
+                    (
+                        self.model.blocks[layer].mlp.W_out.data.to("cpu"),
+                        replacement.to("cpu"),
+                    ),
+                ]
+            self.modified_layers["mlp"][layer] = history
+            self.model.blocks[layer].mlp.W_out.data.copy_(replacement)
         return self.model.blocks[layer].mlp.W_out.data
 
+    def _template_token_parts(self) -> tuple[list[int] | None, list[int] | None]:
+        prefix = getattr(self.chat_template, "_prefix", None)
+        suffix = getattr(self.chat_template, "_suffix", None)
+        if prefix is None or suffix is None:
+            # Jinja-backed templates have no fixed halves to pre-tokenize
+            return None, None
+        key = (prefix, suffix)
+        if key not in self._prompt_parts_cache:
+            tokenizer = self.model.tokenizer
+            self._prompt_parts_cache[key] = (
+                tokenizer(prefix).input_ids,  # keeps BOS/special-token handling
+                tokenizer(suffix, add_special_tokens=False).input_ids,
+            )
+        return self._prompt_parts_cache[key]
+
+    def _encode_sharded(
+        self, texts: list[str], add_special_tokens: bool, max_length: int
+    ) -> list[list[int]]:
+        # fast tokenizers release the GIL inside the Rust backend, so sharding
+        # a big list across threads overlaps the BPE work; short lists and
+        # slow tokenizers just run inline. Truncating here keeps one runaway
+        # prompt from inflating every downstream pad width past the context.
+        tokenizer = self.model.tokenizer
+        encode_kwargs = {
+            "add_special_tokens": add_special_tokens,
+            "padding": False,
+            "truncation": True,
+            "max_length": max_length,
+        }
+        n_workers = min(os.cpu_count() or 1, len(texts) // 256)
+        if n_workers <= 1 or not getattr(tokenizer, "is_fast", False):
+            return tokenizer(texts, **encode_kwargs).input_ids
+        shard_size = math.ceil(len(texts) / n_workers)
+        shards = [
+            texts[i : i + shard_size] for i in range(0, len(texts), shard_size)
+        ]
+        with ThreadPoolExecutor(max_workers=n_workers) as pool:
+            encoded = pool.map(
+                lambda shard: tokenizer(shard, **encode_kwargs).input_ids,
+                shards,
+            )
+        return [ids for shard_ids in encoded for ids in shard_ids]
+
     def tokenize_instructions_fn(
         self, instructions: list[str]
     ) -> Int[Tensor, "batch_size seq_len"]:
-        prompts = [
-            self.chat_template.format(instruction=instruction)
-            for instruction in instructions
-        ]
-        return self.model.tokenizer(
-            prompts, padding=True, truncation=False, return_tensors="pt"
-        ).input_ids
+        tokenizer = self.model.tokenizer
+        prefix_ids, suffix_ids = self._template_token_parts()
+        if prefix_ids is None:
+            prompts = [
+                self.chat_template.format(instruction=instruction)
+                for instruction in instructions
+            ]
+            encoded = self._encode_sharded(
+                prompts, add_special_tokens=True, max_length=self.model.cfg.n_ctx
+            )
+            rows = [torch.tensor(ids, dtype=torch.long) for ids in encoded]
+        else:
+            # tokenize only the instruction bodies and splice the cached
+            # template ids around them; merges at the template boundary can
+            # differ slightly from tokenizing the fully formatted prompt
+            encoded = self._encode_sharded(
+                list(instructions),
+                add_special_tokens=False,
+                # leave room for the spliced template halves
+                max_length=self.model.cfg.n_ctx - len(prefix_ids) - len(suffix_ids),
+            )
+            rows = [
+                torch.tensor(prefix_ids + ids + suffix_ids, dtype=torch.long)
+                for ids in encoded
+            ]
+        # pad_sequence pads on the right; flipping twice left-pads for free
+        padded = torch.nn.utils.rnn.pad_sequence(
+            [row.flip(0) for row in rows],
+            batch_first=True,
+            padding_value=tokenizer.pad_token_id,
+        ).flip(1)
+        # pad widths to a multiple of 8 so prompt shapes stay stable and the
+        # generation buffer (and any compiled graphs) get reused across calls
+        extra = -padded.shape[1] % 8
+        if extra:
+            padded = F.pad(padded, (extra, 0), value=tokenizer.pad_token_id)
+        return padded
 
     def generate_logits(
         self,
@@ -354,33 +587,116 @@ class ModelAbliterator:
         Float[Tensor, "batch_size seq_len d_vocab"], Int[Tensor, "batch_size seq_len"]
     ]:
         # does most of the model magic
-        all_toks = torch.zeros(
-            (toks.shape[0], toks.shape[1] + max_tokens_generated),
-            dtype=torch.long,
-            device=toks.device,
+        # prefill once, then feed only the newly generated token back through
+        # the KV cache so each decode step is O(1) in prefix length instead of
+        # re-running the whole prefix every step
+        batch_size, seq_len = toks.shape
+        total_len = seq_len + max_tokens_generated
+        buf = self._gen_buf
+        if (
+            buf is None
+            or buf.device != toks.device
+            or buf.shape[0] < batch_size
+            or buf.shape[1] < total_len
+        ):
+            buf = torch.empty(
+                (
+                    batch_size if buf is None else max(batch_size, buf.shape[0]),
+                    total_len if buf is None else max(total_len, buf.shape[1]),
+                ),
+                dtype=torch.long,
+                device=toks.device,
+            )
+            self._gen_buf = buf
+        # NOTE: the returned token tensor is a view of this shared buffer and
+        # is overwritten by the next generate_logits call
+        all_toks = buf[:batch_size, :total_len]
+        all_toks[:, :seq_len] = toks
+        all_toks[:, seq_len:].zero_()
+        hooks_active = bool(self.fwd_hooks) or any(
+            len(hp.fwd_hooks) for hp in self.model.hook_points()
+        )
+        # caching hooks record only the most recent forward, so a multi-step
+        # generate that is being recorded must re-run the full sequence each
+        # step (the pre-KV-cache behavior) to leave whole-sequence activations
+        # in the cache; KV decode would leave just the final one-token step.
+        # single-step calls never read the cache back, so allocating one would
+        # be pure peak-VRAM overhead on every capture batch
+        use_kv_cache = max_tokens_generated > 1 and not hooks_active
+        past_kv_cache = (
+            HookedTransformerKeyValueCache.init_cache(
+                self.model.cfg, self.model.cfg.device, batch_size
+            )
+            if use_kv_cache
+            else None
         )
-        all_toks[:, : toks.shape[1]] = toks
-        generating = list(range(toks.shape[0]))
+        # lives on the token device: capture batches arrive pre-uploaded to
+        # the GPU, while plain generate calls still pass CPU tensors
+        finished = torch.zeros(batch_size, dtype=torch.bool, device=toks.device)
+        logit_chunks = []
+        step_toks = toks
+        # only the unhooked decode steps go through the compiled module; the
+        # prefill shape varies per batch and hooked forwards need eager mode
+        use_compiled = self._compiled_model is not None and not hooks_active
+        forward = self.model
+        stop_at_layer = kwargs.pop("stop_at_layer", None)
         for i in range(max_tokens_generated):
-            logits = self.model(
-                all_toks[generating, : -max_tokens_generated + i], *args, **kwargs
+            if i == 0 and stop_at_layer is None:
+                # only position -1 of the prefill is ever consumed downstream,
+                # so stop before the unembed and project just the final
+                # residual instead of materializing [B, seq, d_vocab] logits;
+                # past_kv_cache is simply None on the uncached paths
+                resid = forward(
+                    step_toks,
+                    *args,
+                    past_kv_cache=past_kv_cache,
+                    stop_at_layer=self.model.cfg.n_layers,
+                    **kwargs,
+                )
+                step_logits = self.model.unembed(
+                    self.model.ln_final(resid[:, -1:, :])
+                )
+            elif not use_kv_cache:
+                step_logits = forward(
+                    all_toks[:, : seq_len + i],
+                    *args,
+                    stop_at_layer=stop_at_layer,
+                    **kwargs,
+                )[:, -1:, :]
+            else:
+                step_logits = forward(
+                    step_toks,
+                    *args,
+                    past_kv_cache=past_kv_cache,
+                    stop_at_layer=stop_at_layer,
+                    **kwargs,
+                )
+            logit_chunks.append(step_logits)
+            next_tokens_device = step_logits[:, -1, :].argmax(dim=-1)
+            if self._neg_toks.device != next_tokens_device.device:
+                self._neg_toks = self._neg_toks.to(next_tokens_device.device)
+            next_tokens = next_tokens_device.to(all_toks.device)
+            all_toks[:, seq_len + i] = torch.where(
+                finished, all_toks[:, seq_len + i], next_tokens
             )
-            next_tokens = logits[:, -1, :].argmax(dim=-1).to("cpu")
-            all_toks[generating, -max_tokens_generated + i] = next_tokens
-            if drop_refusals and any(
-                negative_tok in next_tokens for negative_tok in self.negative_toks
+            if (
+                drop_refusals
+                and torch.isin(next_tokens_device, self._neg_toks).any()
             ):
                 # refusals we handle differently: if it's misbehaving, we stop all batches and move on to the next one
                 break
             if stop_at_eos:
-                for batch_idx in generating:
-                    generating = [
-                        i
-                        for i in range(toks.shape[0])
-                        if all_toks[i][-1] != self.model.tokenizer.eos_token_id
-                    ]
-                if len(generating) == 0:
+                finished = finished | (
+                    next_tokens == self.model.tokenizer.eos_token_id
+                )
+                if bool(finished.all()):
                     break
+            step_toks = next_tokens.unsqueeze(-1)
+            if use_compiled:
+                forward = self._compiled_model
+        logits = (
+            torch.cat(logit_chunks, dim=1) if len(logit_chunks) > 1 else logit_chunks[0]
+        )
         return logits, all_toks
 
     def generate(
@@ -438,19 +754,32 @@ class ModelAbliterator:
     ]:
         fwd_hooks = fwd_hooks or []
         if names_filter is None and self.activation_layers:
-
-            def activation_layering(namefunc: str):
-                return any(s in namefunc for s in self.activation_layers)
-
-            names_filter = activation_layering
-
-        cache_dict, fwd, bwd = self.model.get_caching_hooks(
-            names_filter,
-            incl_bwd,
-            device,
-            remove_batch_dim=remove_batch_dim,
-            pos_slice=utils.Slice(None),
-        )
+            if self._default_names_filter is None:
+
+                def activation_layering(namefunc: str):
+                    return any(s in namefunc for s in self.activation_layers)
+
+                self._default_names_filter = activation_layering
+
+            names_filter = self._default_names_filter
+
+        # the hooks close over their cache dict, so reusing them just means
+        # clearing that dict instead of rebuilding every closure per batch;
+        # keying on the filter object (not its id) keeps it alive and cannot
+        # alias a dead filter whose address got reused
+        hooks_key = (names_filter, incl_bwd, device, remove_batch_dim)
+        cached_hooks = self._caching_hooks_cache.get(hooks_key)
+        if cached_hooks is None:
+            cached_hooks = self.model.get_caching_hooks(
+                names_filter,
+                incl_bwd,
+                device,
+                remove_batch_dim=remove_batch_dim,
+                pos_slice=utils.Slice(None),
+            )
+            self._caching_hooks_cache[hooks_key] = cached_hooks
+        cache_dict, fwd, bwd = cached_hooks
+        cache_dict.clear()
 
         fwd_hooks = fwd_hooks + fwd + self.fwd_hooks
 
@@ -471,7 +800,10 @@ class ModelAbliterator:
             if incl_bwd:
                 model_out.backward()
 
-        return model_out, cache_dict
+        # the hooks write into one reused dict per hooks_key and clear() it on
+        # the next call; hand back a shallow copy (negligible next to the
+        # forward) so callers can hold caches from successive calls
+        return model_out, dict(cache_dict)
 
     def apply_refusal_dirs(
         self,
@@ -482,16 +814,26 @@ class ModelAbliterator:
     ):
         if layers is None:
             layers = list(range(1, self.model.cfg.n_layers))
+        layers = [layer for layer in layers if layer not in self._blacklisted]
         for refusal_dir in refusal_dirs:
-            for layer in layers:
-                for modifying in [(W_O, self.layer_attn), (mlp, self.layer_mlp)]:
-                    if not modifying[0]:
-                        continue
-                    matrix = modifying[1](layer)
-                    if refusal_dir.device != matrix.device:
-                        refusal_dir = refusal_dir.to(matrix.device)
-                    proj = self.calculate_scaled_projection(matrix, refusal_dir)
-                    modifying[1](layer, matrix - proj)
+            for modifying in [(W_O, self.layer_attn), (mlp, self.layer_mlp)]:
+                if not modifying[0]:
+                    continue
+                # group layers by device and project the whole stack in one
+                # batched kernel instead of a matvec+subtract launch per matrix
+                by_device = {}
+                for layer in layers:
+                    by_device.setdefault(modifying[1](layer).device, []).append(layer)
+                for device, device_layers in by_device.items():
+                    stack = torch.stack(
+                        [modifying[1](layer) for layer in device_layers]
+                    )
+                    # weights may be bf16 while refusal dirs arrive in fp32
+                    direction = refusal_dir.to(device=device, dtype=stack.dtype)
+                    coef = stack @ direction
+                    stack -= coef.unsqueeze(-1) * direction
+                    for idx, layer in enumerate(device_layers):
+                        modifying[1](layer, stack[idx])
 
     def induce_refusal_dir(
         self,
@@ -507,8 +849,13 @@ class ModelAbliterator:
             for modifying in [(W_O, self.layer_attn), (mlp, self.layer_mlp)]:
                 if modifying[0]:
                     matrix = modifying[1](layer)
-                    if refusal_dir.device != matrix.device:
-                        refusal_dir = refusal_dir.to(matrix.device)
+                    if (
+                        refusal_dir.device != matrix.device
+                        or refusal_dir.dtype != matrix.dtype
+                    ):
+                        refusal_dir = refusal_dir.to(
+                            device=matrix.device, dtype=matrix.dtype
+                        )
                     proj = self.calculate_scaled_projection(matrix, refusal_dir)
                     avg_proj = refusal_dir * self.get_avg_projections(
                         utils.get_act_name(self.activation_layers[0], layer),
@@ -536,13 +883,13 @@ class ModelAbliterator:
                 activation_layers = self.activation_layers
 
             if use_hooks:
-                hooks = self.fwd_hooks
-                hook_fn = functools.partial(
-                    self.ortho_complement_hook, direction=refusal_dir
-                )
-                self.fwd_hooks = before_hooks + [
-                    (act_name, hook_fn) for ln, act_name in self.get_all_act_names()
-                ]
+                if self._test_dir_hooks is None:
+                    self._test_dir_hooks = [
+                        (act_name, self._buffered_direction_hook)
+                        for _, act_name in self.get_all_act_names()
+                    ]
+                self._hook_direction = refusal_dir
+                self.fwd_hooks = before_hooks + self._test_dir_hooks
                 return self.measure_scores(**kwargs)
             else:
                 with self:
@@ -557,18 +904,89 @@ class ModelAbliterator:
         positive: bool = False,
         use_hooks: bool = True,
         invert: bool = False,
+        directions_per_batch: int = 1,
     ) -> list[tuple[float, str]]:
         dirs = self.refusal_dirs(invert=invert)
         if self.modified:
             print(
                 "WARNING: Modified; will restore model to current modified state each run"
             )
+        which = "positive" if positive else "negative"
         scores = []
+        if use_hooks and directions_per_batch > 1:
+            # the projection hook acts independently per row, so several
+            # candidates can share one forward with the prompts replicated
+            # once per direction
+            for group in tqdm(list(batch(list(dirs.items()), directions_per_batch))):
+                directions = torch.stack([d for _, d in group])
+                group_scores = self.measure_scores_batched(directions, N=N)
+                for idx, direction in enumerate(group):
+                    scores.append((group_scores[which][idx], direction))
+            return sorted(scores, key=lambda x: x[0])
         for direction in tqdm(dirs.items()):
-            score = self.test_dir(direction[1], N=N, use_hooks=use_hooks)[int(positive)]
+            score = self.test_dir(direction[1], N=N, use_hooks=use_hooks)[which]
             scores.append((score, direction))
         return sorted(scores, key=lambda x: x[0])
 
+    def measure_scores_batched(
+        self,
+        directions: Float[Tensor, "directions d_model"],
+        N: int = 4,
+        sampled_token_ct: int = 8,
+        measure: str = "max",
+        batch_measure: str = "max",
+    ) -> dict[str, Float[Tensor, "directions"]]:
+        # evaluate several candidate directions in one forward: each prompt
+        # copy gets its own row-wise direction in the projection hook
+        toks = self.tokenize_instructions_fn(instructions=self.harmful_inst_test[:N])
+        n_prompts = toks.shape[0]
+        n_dirs = directions.shape[0]
+        rep_toks = toks.repeat(n_dirs, 1)
+        dir_rows = directions.repeat_interleave(n_prompts, dim=0).to(
+            self.model.cfg.device, self.model.cfg.dtype
+        )
+        # one upload per device the model spans; the hook fires per layer,
+        # act type and step and must not re-ship the [K*N, d_model] matrix
+        dir_rows_by_device = {dir_rows.device: dir_rows}
+
+        def _per_row_hook(
+            activation: Float[Tensor, "... d_model"], hook: HookPoint
+        ) -> Float[Tensor, "... d_model"]:
+            rows = dir_rows_by_device.get(activation.device)
+            if rows is None or rows.dtype != activation.dtype:
+                rows = dir_rows.to(device=activation.device, dtype=activation.dtype)
+                dir_rows_by_device[activation.device] = rows
+            coef = (activation * rows[:, None, :]).sum(dim=-1, keepdim=True)
+            return activation - coef * rows[:, None, :]
+
+        before_hooks = self.fwd_hooks
+        try:
+            self.fwd_hooks = before_hooks + [
+                (act_name, _per_row_hook) for _, act_name in self.get_all_act_names()
+            ]
+            logits, cache = self.run_with_cache(
+                rep_toks, max_new_tokens=sampled_token_ct, drop_refusals=False
+            )
+        finally:
+            self.fwd_hooks = before_hooks
+
+        negative_score, positive_score = self.measure_scores_from_logits(
+            logits, sampled_token_ct, measure=batch_measure
+        )
+
+        def _reduce_rows(scores: Float[Tensor, "directions prompts"]):
+            reduced = measure_fn(measure, scores, dim=-1)
+            # max/median hand back (values, indices); mean is already the
+            # [directions] tensor, so indexing [0] would grab one row
+            return reduced[0] if isinstance(reduced, tuple) else reduced
+
+        negative_score = _reduce_rows(negative_score.view(n_dirs, n_prompts))
+        positive_score = _reduce_rows(positive_score.view(n_dirs, n_prompts))
+        return {
+            "negative": negative_score.to("cpu"),
+            "positive": positive_score.to("cpu"),
+        }
+
     def measure_scores(
         self,
         N: int = 4,
@@ -599,9 +1017,14 @@ class ModelAbliterator:
         sequence: int,
         measure: str = "max",
     ) -> tuple[Float[Tensor, "batch_size"], Float[Tensor, "batch_size"]]:
-        normalized_scores = torch.softmax(logits[:, -sequence:, :].to("cpu"), dim=-1)[
-            :, :, list(self.positive_toks) + list(self.negative_toks)
-        ]
+        # softmax only over the handful of scored tokens: gather their logits,
+        # normalize against one logsumexp over the vocab, and ship just the
+        # per-batch scalars to CPU instead of the full [B, seq, d_vocab] tensor
+        tail = logits[:, -sequence:, :]
+        if self._score_toks.device != tail.device:
+            self._score_toks = self._score_toks.to(tail.device)
+        lse = torch.logsumexp(tail, dim=-1, keepdim=True)
+        normalized_scores = (tail.index_select(-1, self._score_toks) - lse).exp()
 
         normalized_positive, normalized_negative = torch.split(
             normalized_scores, [len(self.positive_toks), len(self.negative_toks)], dim=2
@@ -612,10 +1035,10 @@ class ModelAbliterator:
 
         negative_score_per_batch = measure_fn(
             measure, max_negative_score_per_sequence, dim=-1
-        )[0]
+        )[0].to("cpu")
         positive_score_per_batch = measure_fn(
             measure, max_positive_score_per_sequence, dim=-1
-        )[0]
+        )[0].to("cpu")
         return negative_score_per_batch, positive_score_per_batch
 
     def do_resid(
@@ -657,19 +1080,12 @@ class ModelAbliterator:
     def unembed_resid(
         self, resid: Float[Tensor, "layer batch d_model"], pos: int = -1
     ) -> Float[Tensor, "layer batch d_vocab"]:
+        # plain matmul hits cuBLAS on W_U's device without einops dispatch
         W_U = self.model.W_U
         if pos is None:
-            return einops.einsum(
-                resid.to(W_U.device),
-                W_U,
-                "layer batch d_model, d_model d_vocab -> layer batch d_vocab",
-            ).to("cpu")
+            return (resid.to(W_U.device) @ W_U).to("cpu")
         else:
-            return einops.einsum(
-                resid[:, pos, :].to(W_U.device),
-                W_U,
-                "layer d_model, d_model d_vocab -> layer d_vocab",
-            ).to("cpu")
+            return (resid[:, pos, :].to(W_U.device) @ W_U).to("cpu")
 
     def create_layer_rankings(
         self,
@@ -681,28 +1097,31 @@ class ModelAbliterator:
 
         decomposed_resid_harmful, decomposed_resid_harmless, labels = decomposer()
 
-        W_U = self.model.W_U.to("cpu")
         unembedded_harmful = self.unembed_resid(decomposed_resid_harmful)
         unembedded_harmless = self.unembed_resid(decomposed_resid_harmless)
 
-        sorted_harmful_indices = torch.argsort(
-            unembedded_harmful, dim=1, descending=True
-        )
-        sorted_harmless_indices = torch.argsort(
-            unembedded_harmless, dim=1, descending=True
+        token_tensor = torch.tensor(list(token_set), dtype=torch.long)
+        token_tensor_b = (
+            token_tensor
+            if token_set_b is None
+            else torch.tensor(list(token_set_b), dtype=torch.long)
         )
 
-        harmful_set = torch.isin(sorted_harmful_indices, torch.tensor(list(token_set)))
-        harmless_set = torch.isin(
-            sorted_harmless_indices,
-            torch.tensor(list(token_set if token_set_b is None else token_set_b)),
-        )
+        harmful_ranks = self._token_ranks(unembedded_harmful, token_tensor)
+        harmless_ranks = self._token_ranks(unembedded_harmless, token_tensor_b)
 
-        indices_in_set = zip(
-            harmful_set.nonzero(as_tuple=True)[1],
-            harmless_set.nonzero(as_tuple=True)[1],
-        )
-        return indices_in_set
+        return zip(harmful_ranks.flatten(), harmless_ranks.flatten())
+
+    def _token_ranks(
+        self,
+        unembedded: Float[Tensor, "layer d_vocab"],
+        token_tensor: Int[Tensor, "tokens"],
+    ) -> Int[Tensor, "layer tokens"]:
+        # rank each target token against the vocab in O(V) instead of paying
+        # a full O(V log V) argsort per layer just to look up a few positions
+        target = unembedded.index_select(1, token_tensor.to(unembedded.device))
+        ranks = (unembedded.unsqueeze(1) > target.unsqueeze(-1)).sum(dim=-1)
+        return torch.sort(ranks, dim=1).values
 
     def mse_positive(
         self, N: int = 128, batch_size: int = 8, last_indices: int = 1
@@ -711,6 +1130,9 @@ class ModelAbliterator:
         # Idea being to get a general sense of how the "normal" direction has been altered.
         # This is to compare ORIGINAL functionality to ABLATED functionality, not for ground truth.
 
+        if last_indices < 1:
+            # see create_activation_cache: -0 would slice the whole sequence
+            raise ValueError("last_indices must be >= 1")  # noqa: TRY003
         # load full training set to ensure alignment
         toks = self.tokenize_instructions_fn(
             instructions=self.harmful_inst_train[:N] + self.harmless_inst_train[:N]
@@ -721,24 +1143,51 @@ class ModelAbliterator:
         # select for just harmless
         toks = toks[splitpos:]
         self.loss_harmless = {}
-
-        for i in tqdm(range(0, min(N, len(toks)), batch_size)):
-            logits, cache = self.run_with_cache(
-                toks[i : min(i + batch_size, len(toks))]
-            )
+        # preallocate each accumulator once and write batches into slices;
+        # growing with torch.cat re-copied every previously seen row per batch
+        n_rows = min(N, len(toks))
+        pin = torch.cuda.is_available()
+        write_ptr = 0
+        # per-key device-side reduction outputs, reused across batches (see
+        # create_activation_cache)
+        stage: dict[str, Tensor] = {}
+
+        # free whatever is reclaimable once up front; per-batch empty_cache
+        # synchronizes the device and defeats the caching allocator's reuse
+        clear_mem()
+        for i in tqdm(range(0, n_rows, batch_size)):
+            with torch.inference_mode():
+                logits, cache = self.run_with_cache(
+                    toks[i : min(i + batch_size, n_rows)]
+                )
+            rows = 0
             for key in cache:
                 if any(k in key for k in self.activation_layers):
-                    tensor = torch.mean(cache[key][:, -last_indices:, :], dim=1).to(
-                        "cpu"
-                    )
-                    if key not in self.loss_harmless:
-                        self.loss_harmless[key] = tensor
-                    else:
-                        self.loss_harmless[key] = torch.cat(
-                            (self.loss_harmless[key], tensor), dim=0
+                    view = cache[key][:, -last_indices:, :]
+                    rows = view.shape[0]
+                    st = stage.get(key)
+                    if st is None or st.shape[0] < rows:
+                        st = torch.empty(
+                            (rows, *view.shape[2:]),
+                            device=view.device,
+                            dtype=view.dtype,
+                        )
+                        stage[key] = st
+                    tensor = torch.mean(view, dim=1, out=st[:rows])
+                    buf = self.loss_harmless.get(key)
+                    if buf is None:
+                        buf = torch.empty(
+                            (n_rows, *tensor.shape[1:]),
+                            dtype=tensor.dtype,
+                            pin_memory=pin,
                         )
+                        self.loss_harmless[key] = buf
+                    buf[write_ptr : write_ptr + rows].copy_(tensor, non_blocking=pin)
+            write_ptr += rows
             del logits, cache
-            clear_mem()
+        if pin:
+            # make sure the async D2H copies have landed before we read them
+            torch.cuda.synchronize()
 
         return {
             k: F.mse_loss(
@@ -747,6 +1196,160 @@ class ModelAbliterator:
             for k in self.loss_harmless
         }
 
+    def _pack_token_buckets(
+        self, toks: Int[Tensor, "batch_size seq_len"], max_batch_tokens: int
+    ) -> list[Int[Tensor, "bucket"]]:
+        # greedy length-sorted packing: each bucket pads only to its own max,
+        # so a handful of long prompts no longer drag every batch up to the
+        # global width, and each forward stays under a fixed token budget
+        lengths = (toks != self.model.tokenizer.pad_token_id).sum(-1)
+        order = torch.argsort(lengths, descending=True, stable=True)
+        buckets = []
+        current: list[int] = []
+        width = 0
+        for idx in order.tolist():
+            length = int(lengths[idx])
+            if current and max(width, length) * (len(current) + 1) > max_batch_tokens:
+                buckets.append(torch.tensor(current, dtype=torch.long))
+                current = []
+                width = 0
+            current.append(idx)
+            width = max(width, length)
+        if current:
+            buckets.append(torch.tensor(current, dtype=torch.long))
+        return buckets
+
+    def _spill_dir(self, cache_path: str | None) -> Path | None:
+        if cache_path is None:
+            return None
+        # spill the per-key buffers to disk-backed memmaps so N can grow far
+        # past host RAM; numpy has no bf16, so spilled caches are fp16
+        cache_dir = Path(cache_path).expanduser()
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        return cache_dir
+
+    def _staged_batches(self, toks, batches: list[Int[Tensor, "bucket"]], pin: bool):
+        pad_id = self.model.tokenizer.pad_token_id
+        device = self.model.cfg.device
+        copy_stream = torch.cuda.Stream() if pin else None
+
+        def _stage(idx: Tensor) -> Tensor:
+            start, stop = int(idx[0]), int(idx[-1]) + 1
+            if stop - start == len(idx):
+                # contiguous batches slice as a view, which keeps the host
+                # tensor's pinning and lets the upload run asynchronously
+                batch_toks = toks[start:stop]
+            else:
+                batch_toks = toks[idx]
+            # rows are left-padded, so dropping the all-pad leading columns
+            # shared by the bucket costs nothing and shrinks the forward
+            width = int((batch_toks != pad_id).sum(-1).max())
+            batch_toks = batch_toks[:, -width:]
+            if copy_stream is None:
+                return batch_toks
+            # upload on a side stream so the next bucket's H2D copy hides
+            # behind the current bucket's forward
+            with torch.cuda.stream(copy_stream):
+                return batch_toks.to(device, non_blocking=batch_toks.is_pinned())
+
+        staged = _stage(batches[0]) if batches else None
+        for bi, idx in enumerate(batches):
+            batch_toks = staged
+            if copy_stream is not None:
+                torch.cuda.current_stream().wait_stream(copy_stream)
+                batch_toks.record_stream(torch.cuda.current_stream())
+            staged = _stage(batches[bi + 1]) if bi + 1 < len(batches) else None
+            if batch_toks.dtype != torch.long:
+                # int32-staged tokens upcast on device for the embedding gather
+                batch_toks = batch_toks.long()
+            yield idx, batch_toks
+
+    def _record_labels(self, z_label, logits, positions, measure_refusal: int):
+        if measure_refusal > 1:
+            scores = self.measure_scores_from_logits(logits, measure_refusal)[0]
+            for row, pos in enumerate(positions):
+                z_label[pos] = scores[row]
+
+    def _alloc_cache_buffer(self, key: str, shape, pin: bool, cache_dir) -> Tensor:
+        if cache_dir is not None:
+            import numpy as np
+
+            arr = np.lib.format.open_memmap(
+                str(cache_dir / f"{key}.npy"),
+                mode="w+",
+                dtype="float16",
+                shape=shape,
+            )
+            return torch.from_numpy(arr)
+        # reductions happen in fp32; the copy into this buffer narrows to the
+        # storage dtype on the way out
+        return torch.empty(shape, dtype=self.cache_dtype, pin_memory=pin)
+
+    def _store_batch(
+        self,
+        cache,
+        base: dict[str, Tensor],
+        stage: dict[str, Tensor],
+        idx: Tensor,
+        write_ptr: int,
+        n_rows: int,
+        last_indices: int,
+        pin: bool,
+        cache_dir,
+    ) -> int:
+        rows = 0
+        for key in cache:
+            if self.activation_layers is not None and not any(
+                k in key for k in self.activation_layers
+            ):
+                continue
+            # rows are left-padded, so the last last_indices tokens line up
+            # across the batch and this is one contiguous slice + one mean
+            # kernel — no per-example gather needed
+            view = cache[key][:, -last_indices:, :]
+            rows = view.shape[0]
+            st = stage.get(key)
+            if st is None or st.shape[0] < rows:
+                st = torch.empty(
+                    (rows, *view.shape[2:]), device=view.device, dtype=torch.float32
+                )
+                stage[key] = st
+            tensor = torch.mean(view, dim=1, dtype=torch.float32, out=st[:rows])
+            buf = base.get(key)
+            if buf is None:
+                buf = self._alloc_cache_buffer(
+                    key, (n_rows, *tensor.shape[1:]), pin, cache_dir
+                )
+                base[key] = buf
+            if cache_dir is not None:
+                # scatter straight to the original row positions; the in-RAM
+                # reorder at the end would defeat the spill
+                buf[idx] = tensor.to(device="cpu", dtype=buf.dtype)
+            else:
+                buf[write_ptr : write_ptr + rows].copy_(tensor, non_blocking=pin)
+        return rows
+
+    def _throttle_queue(self, inflight: deque, pin: bool):
+        if not pin:
+            return
+        evt = torch.cuda.Event()
+        evt.record()
+        inflight.append(evt)
+        if len(inflight) > 4:
+            # an unbounded queue of batches eventually forces the caching
+            # allocator into a blocking mid-run flush; waiting on a
+            # long-finished event costs nothing
+            inflight.popleft().synchronize()
+
+    def _restore_row_order(self, base, write_order, n_rows: int, cache_dir):
+        # rows land in bucket order; put the buffers back into original input
+        # order (spilled buffers were already scattered into place)
+        order = torch.tensor(write_order, dtype=torch.long)
+        if cache_dir is None and not torch.equal(order, torch.arange(n_rows)):
+            inverse = torch.argsort(order)
+            base = {key: buf[inverse] for key, buf in base.items()}
+        return base
+
     def create_activation_cache(
         self,
         toks,
@@ -755,39 +1358,175 @@ class ModelAbliterator:
         last_indices: int = 1,
         measure_refusal: int = 0,
         stop_at_layer: int | None = None,
+        batches: list[Int[Tensor, "bucket"]] | None = None,
+        cache_path: str | None = None,
     ) -> tuple[ActivationCache, list[str]]:
         # Base functionality for creating an activation cache with a training set, prefer 'cache_activations' for regular usage
 
-        base = {}
-        z_label = [] if measure_refusal > 1 else None
-        for i in tqdm(range(0, min(N, len(toks)), batch_size)):
-            logits, cache = self.run_with_cache(
-                toks[i : min(i + batch_size, len(toks))],
-                max_new_tokens=measure_refusal,
-                stop_at_layer=stop_at_layer,
+        if last_indices < 1:
+            # -0 slices the whole padded sequence, so a 0 here would silently
+            # average left-pad positions into the cache instead of erroring
+            raise ValueError("last_indices must be >= 1")  # noqa: TRY003
+        if measure_refusal > 1 and stop_at_layer is not None:
+            # a truncated forward returns residual-stream tensors, not logits;
+            # scoring would softmax over d_model and index vocab ids into it
+            raise ValueError(  # noqa: TRY003
+                "measure_refusal > 1 needs the full forward; unset "
+                "stop_at_layer/max_layer"
             )
-
-            if measure_refusal > 1:
-                z_label.extend(
-                    self.measure_scores_from_logits(logits, measure_refusal)[0]
+        cache_dir = self._spill_dir(cache_path)
+
+        base: dict[str, Tensor] = {}
+        # preallocate each accumulator once and write batches into slices;
+        # growing with torch.cat re-copied every previously seen row per batch
+        n_rows = min(N, len(toks))
+        if batches is None:
+            batches = [
+                torch.arange(i, min(i + batch_size, n_rows))
+                for i in range(0, n_rows, batch_size)
+            ]
+        z_label = [None] * n_rows if measure_refusal > 1 else None
+        pin = torch.cuda.is_available()
+        autocast_ctx = (
+            torch.autocast("cuda", dtype=torch.bfloat16)
+            if pin
+            else contextlib.nullcontext()
+        )
+        write_ptr = 0
+        # per-key device-side reduction outputs, reused across batches so the
+        # loop stops allocating a fresh mean tensor per key per batch; stream
+        # ordering keeps each D2H copy ahead of the next overwrite
+        stage: dict[str, Tensor] = {}
+        # rows land in bucket order; remember it so the buffers can be put
+        # back into original input order before returning
+        write_order: list[int] = []
+        # free whatever is reclaimable once up front; per-batch empty_cache
+        # synchronizes the device and defeats the caching allocator's reuse
+        clear_mem()
+        # events marking the tail of each batch's work; syncing on the oldest
+        # keeps the CPU a bounded number of batches ahead of the device
+        inflight: deque = deque()
+
+        # NOTE: no manual CUDAGraph capture here — the caching hooks run
+        # Python per forward and allocate fresh output tensors, so a replayed
+        # graph would hand back stale static buffers; launch overhead is
+        # attacked instead via torch.compile(mode="reduce-overhead"), which
+        # applies graphs only where they are safe
+        staged = self._staged_batches(toks, batches, pin)
+        for idx, batch_toks in tqdm(staged, total=len(batches)):
+            # grad is globally disabled in __init__, but inference_mode also
+            # skips version-counter and view-tracking bookkeeping per op
+            with torch.inference_mode(), autocast_ctx:
+                logits, cache = self.run_with_cache(
+                    batch_toks,
+                    max_new_tokens=measure_refusal,
+                    stop_at_layer=stop_at_layer,
                 )
-            for key in cache:
-                if self.activation_layers is None or any(
-                    k in key for k in self.activation_layers
-                ):
-                    tensor = torch.mean(
-                        cache[key][:, -last_indices:, :].to("cpu"), dim=1
-                    )
-                    if key not in base:
-                        base[key] = tensor
-                    else:
-                        base[key] = torch.cat((base[key], tensor), dim=0)
+
+            positions = idx.tolist()
+            self._record_labels(z_label, logits, positions, measure_refusal)
+            write_ptr += self._store_batch(
+                cache,
+                base,
+                stage,
+                idx,
+                write_ptr,
+                n_rows,
+                last_indices,
+                pin,
+                cache_dir,
+            )
+            write_order.extend(positions)
 
             del logits, cache
-            clear_mem()
+            self._throttle_queue(inflight, pin)
+        if pin:
+            # make sure the async D2H copies have landed before we read them
+            torch.cuda.synchronize()
+        base = self._restore_row_order(base, write_order, n_rows, cache_dir)
 
         return ActivationCache(base, self.model), z_label
 
+    def _dedupe_instructions(self, run_insts: list[str]):
+        # the model is deterministic on identical input ids, so forward each
+        # distinct prompt once and fan the rows back out afterwards
+        index_of: dict[str, int] = {}
+        unique: list[str] = []
+        fan_out = []
+        for inst in run_insts:
+            pos = index_of.setdefault(inst, len(unique))
+            if pos == len(unique):
+                unique.append(inst)
+            fan_out.append(pos)
+        if len(unique) == len(run_insts):
+            return run_insts, None  # nothing shared; skip the fan-out copy
+        return unique, fan_out
+
+    def _tokenize_with_cache(self, run_insts: list[str], use_token_cache: bool):
+        toks = None
+        token_cache = None
+        if use_token_cache:
+            # hyperparameter sweeps re-enter here with the same lists over and
+            # over; key on everything that changes the token matrix and skip
+            # tokenization entirely on a hit
+            digest = hashlib.sha256(
+                repr(
+                    (
+                        getattr(self.model.tokenizer, "name_or_path", self.MODEL_PATH),
+                        type(self.chat_template).__name__,
+                        getattr(self.chat_template, "template", None),
+                        tuple(run_insts),
+                    )
+                ).encode()
+            ).hexdigest()
+            token_cache = CACHE_DIR / "tokens" / f"{digest}.pt"
+            if token_cache.exists():
+                toks = torch.load(token_cache, map_location="cpu")
+        if toks is None:
+            toks = self.tokenize_instructions_fn(instructions=run_insts)
+            if token_cache is not None:
+                token_cache.parent.mkdir(parents=True, exist_ok=True)
+                torch.save(toks, token_cache)
+
+        if torch.cuda.is_available():
+            # stage on host as int32 (halves the bytes each bucket ships over
+            # PCIe) and pinned, so the per-bucket uploads in the capture loop
+            # run as true async H2D copies on the side stream
+            toks = toks.to(torch.int32).pin_memory()
+        return toks
+
+    def _expand_fused(self, fused: ActivationCache, z_label, fan_out):
+        if fan_out is None:
+            return fused, z_label
+        fan = torch.tensor(fan_out, dtype=torch.long)
+        fused = ActivationCache(
+            {key: buf[fan] for key, buf in fused.cache_dict.items()},
+            self.model,
+        )
+        if z_label:
+            z_label = [z_label[pos] for pos in fan_out]
+        return fused, z_label
+
+    def _assign_caches(
+        self, fused: ActivationCache, z_label, splitpos: int, preserve_harmless: bool
+    ):
+        if preserve_harmless:
+            self.harmful = fused
+            self.harmful_z_label = z_label
+            return
+        # slice the shared buffers back into the two caches (views)
+        cache_dict = fused.cache_dict
+        self.harmful = ActivationCache(
+            {key: buf[:splitpos] for key, buf in cache_dict.items()},
+            self.model,
+        )
+        self.harmless = ActivationCache(
+            {key: buf[splitpos:] for key, buf in cache_dict.items()},
+            self.model,
+        )
+        self.harmful_z_label = z_label[:splitpos] if z_label else z_label
+        self.harmless_z_label = z_label[splitpos:] if z_label else z_label
+
     def cache_activations(
         self,
         N: int = 128,
@@ -798,6 +1537,11 @@ class ModelAbliterator:
         activation_layers: int = -1,
         preserve_harmless: bool = True,
         stop_at_layer: int | None = None,
+        max_batch_tokens: int | None = None,
+        max_layer: int | None = None,
+        dedupe: bool = True,
+        cache_path: str | None = None,
+        use_token_cache: bool = True,
     ):
         if hasattr(self, "current_state"):
             print("WARNING: Caching activations using a context")
@@ -818,31 +1562,43 @@ class ModelAbliterator:
             self.harmful_z_label = []
             self.harmless_z_label = []
 
-        # load the full training set here to align all the dimensions (even if we're not going to run harmless)
-        toks = self.tokenize_instructions_fn(
-            instructions=self.harmful_inst_train[:N] + self.harmless_inst_train[:N]
-        )
+        # one fused pass over both halves: same kernels either way, but the
+        # loop/hook/warmup overhead is paid once and the token buckets can
+        # mix rows from both lists; this also subsumes running harmless on a
+        # second stream — there is no separate harmless phase left to overlap,
+        # and the copy stream in the capture loop already covers the transfers
+        harmful_insts = list(self.harmful_inst_train[:N])
+        splitpos = len(harmful_insts)
+        run_insts = harmful_insts
+        if not preserve_harmless:
+            run_insts = harmful_insts + list(self.harmless_inst_train[:N])
 
-        splitpos = min(N, len(self.harmful_inst_train))
-        harmful_toks = toks[:splitpos]
-        harmless_toks = toks[splitpos:]
+        fan_out = None
+        if dedupe:
+            run_insts, fan_out = self._dedupe_instructions(run_insts)
+
+        toks = self._tokenize_with_cache(run_insts, use_token_cache)
+
+        if max_layer is not None and stop_at_layer is None:
+            # running blocks past the deepest layer being analyzed is wasted
+            # FLOPs; capturing resid_post at max_layer needs block max_layer
+            # to have run
+            stop_at_layer = max_layer + 1
 
-        last_indices = last_indices or 1
+        batches = None
+        if max_batch_tokens is not None:
+            batches = self._pack_token_buckets(toks, max_batch_tokens)
 
-        self.harmful, self.harmful_z_label = self.create_activation_cache(
-            harmful_toks,
-            N=N,
+        fused, z_label = self.create_activation_cache(
+            toks,
+            N=len(toks),
             batch_size=batch_size,
             last_indices=last_indices,
             measure_refusal=measure_refusal,
-            stop_at_layer=None,
+            stop_at_layer=stop_at_layer,
+            batches=batches,
+            cache_path=cache_path,
         )
-        if not preserve_harmless:
-            self.harmless, self.harmless_z_label = self.create_activation_cache(
-                harmless_toks,
-                N=N,
-                batch_size=batch_size,
-                last_indices=last_indices,
-                measure_refusal=measure_refusal,
-                stop_at_layer=None,
-            )
+        fused, z_label = self._expand_fused(fused, z_label, fan_out)
+        self._assign_caches(fused, z_label, splitpos, preserve_harmless)
+        self._invalidate_dir_caches()
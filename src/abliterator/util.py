@@ -1,12 +1,39 @@
 import gc
+import os
 from itertools import islice
 
+# must land before torch initializes CUDA: expandable segments let the
+# allocator grow one virtual segment instead of fragmenting across the
+# harmful/harmless capture phases
+os.environ.setdefault(
+    "PYTORCH_CUDA_ALLOC_CONF", "expandable_segments:True,max_split_size_mb:512"
+)
+
 import torch
 from jaxtyping import Float
 from torch import Tensor
 
+if torch.cuda.is_available():
+    # torch may already be imported by the host process; apply the setting
+    # directly too, best effort (fails once allocations are live)
+    try:
+        torch.cuda.memory._set_allocator_settings("expandable_segments:True")
+    except (AttributeError, RuntimeError):
+        pass
+
+
+def batch_slices(seq, n):
+    # O(1) slice views per chunk; no per-chunk list materialization
+    for i in range(0, len(seq), n):
+        yield seq[i : i + n]
+
 
 def batch(iterable, n):
+    # sequences get the zero-copy slice path; the islice path stays for
+    # pure iterators
+    if hasattr(iterable, "__len__") and hasattr(iterable, "__getitem__"):
+        yield from batch_slices(iterable, n)
+        return
     it = iter(iterable)
     while True:
         chunk = list(islice(it, n))
@@ -15,24 +42,54 @@ def batch(iterable, n):
         yield chunk
 
 
-def clear_mem():
+def clear_mem(force: bool = False):
+    # empty_cache flushes the caching allocator and stalls the device, so it
+    # is opt-in (force=True, e.g. between capture phases); routine calls just
+    # collect Python garbage and drain the kernel queue
     gc.collect()
-    torch.cuda.empty_cache()
+    if torch.cuda.is_available():
+        torch.cuda.synchronize()
+        if force:
+            torch.cuda.empty_cache()
+
+
+def _stack_into(tensors, *args, out=None, **kwargs):
+    # "stack" allocates a fresh (k, *shape) output every call, which for
+    # activation-shaped tensors fragments the allocator; this variant writes
+    # into a persistent caller-owned buffer instead
+    if out is None:
+        raise ValueError("'stack_into' requires an out= buffer")  # noqa: TRY003
+    return torch.stack(tensors, *args, out=out, **kwargs)
+
+
+# built once at import; rebuilding the dispatch dict per call and abusing
+# KeyError for control flow was pure overhead in the per-layer hot path
+_MEASURES = {
+    "mean": torch.mean,
+    "median": torch.median,
+    "max": torch.max,
+    "stack": torch.stack,
+    "stack_into": _stack_into,
+}
 
 
 def measure_fn(
-    measure: str, input_tensor: Tensor, *args, **kwargs
+    measure: str, input_tensor: Tensor, *args, out: Tensor | None = None, **kwargs
 ) -> Float[Tensor, "..."]:
-    avail_measures = {
-        "mean": torch.mean,
-        "median": torch.median,
-        "max": torch.max,
-        "stack": torch.stack,
-    }
-    try:
-        return avail_measures[measure](input_tensor, *args, **kwargs)
-    except KeyError:
+    if measure == "median" and input_tensor.dtype in (
+        torch.bfloat16,
+        torch.float16,
+    ):
+        # median is ordering-based and numerically touchy in half precision
+        input_tensor = input_tensor.float()
+    fn = _MEASURES.get(measure)
+    if fn is None:
         raise NotImplementedError(
-            f"Unknown measure function '{measure}'. Available measures:"
-            + ", ".join([f"'{str(fn)}'" for fn in avail_measures.keys()])
+            f"Unknown measure function '{measure}'. Available measures: "
+            + ", ".join(f"'{name}'" for name in _MEASURES)
         )
+    if out is not None:
+        # all registered reductions accept out=, letting callers reuse one
+        # buffer across a loop instead of allocating per call
+        kwargs["out"] = out
+    return fn(input_tensor, *args, **kwargs)